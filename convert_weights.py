@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+# 将 models/2.0.pt 转换为可以内存映射加载的权重文件（models/2.0.mmap.pt），
+# 并对比转换前后的冷加载耗时和内存占用。
+#
+# 用法:
+#   python convert_weights.py            # 转换并测量
+#   python convert_weights.py --no-measure
+
+
+def read_memory_usage():
+    """
+    读取当前进程的内存占用（MB）。
+
+    :return: 字典，rss 为常驻内存，private 为进程私有的匿名内存，
+             shared_file 为文件映射的内存（可以被多个进程共享）。无法读取的项为 None。
+    """
+    usage = {"rss": None, "private": None, "shared_file": None}
+
+    # Linux: 从 /proc 读取，可以区分私有内存和文件映射内存
+    if os.path.exists("/proc/self/status"):
+        fields = {"VmRSS": "rss", "RssAnon": "private", "RssFile": "shared_file"}
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in fields:
+                    usage[fields[key]] = int(value.split()[0]) / 1024
+        return usage
+
+    try:
+        import psutil
+        usage["rss"] = psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        pass
+    return usage
+
+
+def measure(mode):
+    """
+    在当前进程中加载一次模型，返回加载耗时和内存增量。
+
+    :param mode: "legacy"（torch.load + load_state_dict）或 "mmap"。
+    """
+    from gradio_app import load_model
+
+    before = read_memory_usage()
+    start_time = time.time()
+    load_model("cpu", use_mmap=(mode == "mmap"), use_cache=False)
+    load_time = time.time() - start_time
+    after = read_memory_usage()
+
+    result = {"mode": mode, "load_seconds": load_time}
+    for key in before:
+        if before[key] is not None and after[key] is not None:
+            result[f"{key}_mb"] = after[key] - before[key]
+    return result
+
+
+def measure_in_subprocess(mode):
+    """在新进程中测量，保证每次都是冷加载，互不影响。"""
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), "--measure-mode", mode],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="转换模型权重为可内存映射的格式，并测量加载耗时和内存占用")
+    parser.add_argument("--no-measure", action="store_true", help="只转换，不测量")
+    parser.add_argument("--measure-mode", choices=["legacy", "mmap"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # 子进程：测量一次并输出JSON
+    if args.measure_mode:
+        print(json.dumps(measure(args.measure_mode)))
+        return
+
+    from gradio_app import convert_checkpoint, MODEL_WEIGHT_PATH, MODEL_MMAP_WEIGHT_PATH
+
+    start_time = time.time()
+    convert_checkpoint()
+    print(f"已转换 {MODEL_WEIGHT_PATH} -> {MODEL_MMAP_WEIGHT_PATH}，用时 {time.time() - start_time:.2f}秒")
+
+    if args.no_measure:
+        return
+
+    print("\n| 加载方式 | 加载耗时(s) | RSS增量(MB) | 私有内存增量(MB) | 文件映射内存增量(MB) |")
+    print("|---|---|---|---|---|")
+    for mode in ("legacy", "mmap"):
+        result = measure_in_subprocess(mode)
+        columns = [f"{result['load_seconds']:.3f}"]
+        for key in ("rss_mb", "private_mb", "shared_file_mb"):
+            columns.append(f"{result[key]:.1f}" if key in result else "-")
+        print(f"| {mode} | " + " | ".join(columns) + " |")
+
+    print("\n私有内存是每个进程各自独占的部分；文件映射内存由同一台机器上的所有进程共享。")
+
+
+if __name__ == "__main__":
+    main()
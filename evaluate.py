@@ -0,0 +1,295 @@
+import csv
+import time
+import argparse
+import numpy as np
+import torch
+import mido
+import mir_eval
+from pathlib import Path
+
+from gradio_app import (
+    cuda_available,
+    AUDIO_EXTENSIONS,
+    load_model,
+    read_audio,
+    resolve_speed_profile,
+    SPEED_PROFILES,
+    DEFAULT_SPEED_PROFILE,
+)
+from note_export import notes_to_arrays
+
+# 离线评测：在本地的 音频 + 参考MIDI 数据集上，用不同配置运行与 process_audio 相同的转录流程，
+# 用 mir_eval 计算音符级别的 F1，同时统计耗时和实时率（RTF），输出各配置的对比表。
+#
+# 数据目录中的音频文件和参考MIDI按文件名配对，例如 song.wav + song.mid。
+#
+# 用法:
+#   python evaluate.py path/to/dataset --profiles standard fast draft --devices cpu cuda --csv results.csv
+
+MIDI_EXTENSIONS = (".mid", ".midi")
+
+# 钢琴音域，踏板等非音符事件不参与评测
+PIANO_PITCH_RANGE = (21, 108)
+
+# 预热时只转录开头的一小段音频，避免首个配置承担CUDA初始化等一次性开销
+WARMUP_SECONDS = 20
+
+METRIC_NAMES = ("onset_f1", "onset_offset_f1", "onset_offset_velocity_f1")
+
+
+def find_pairs(data_dir):
+    """
+    在数据目录中查找 音频 + 参考MIDI 文件对。
+
+    :return: [(音频路径, MIDI路径), ...]，按文件名排序。
+    """
+    pairs = []
+    for audio_path in sorted(Path(data_dir).rglob("*")):
+        if audio_path.suffix.lower() not in AUDIO_EXTENSIONS:
+            continue
+        for ext in MIDI_EXTENSIONS:
+            midi_path = audio_path.with_suffix(ext)
+            if midi_path.exists():
+                pairs.append((str(audio_path), str(midi_path)))
+                break
+        else:
+            print(f"跳过 {audio_path.name}：找不到对应的参考MIDI")
+    return pairs
+
+
+def read_reference_midi(midi_path):
+    """
+    读取参考MIDI中的音符（不做踏板延音处理）。
+
+    :return: 列名到numpy数组的字典（onset/offset/pitch/velocity）。
+    """
+    active = {}
+    notes = []
+    current_time = 0.0
+
+    # 遍历 MidiFile 时 msg.time 为以秒计的增量时间，已考虑速度变化
+    for msg in mido.MidiFile(midi_path):
+        current_time += msg.time
+        if msg.type not in ("note_on", "note_off"):
+            continue
+
+        key = (msg.channel, msg.note)
+        is_note_on = msg.type == "note_on" and msg.velocity > 0
+
+        # 同一音高重复按下时，先结束之前的音符
+        if key in active:
+            onset, velocity = active.pop(key)
+            notes.append((onset, current_time, msg.note, velocity))
+        if is_note_on:
+            active[key] = (current_time, msg.velocity)
+
+    # 没有松开的音符结束于文件末尾
+    for (channel, pitch), (onset, velocity) in active.items():
+        notes.append((onset, current_time, pitch, velocity))
+
+    notes.sort()
+    return {
+        "onset": np.array([n[0] for n in notes], dtype=np.float64),
+        "offset": np.array([n[1] for n in notes], dtype=np.float64),
+        "pitch": np.array([n[2] for n in notes], dtype=np.int16),
+        "velocity": np.array([n[3] for n in notes], dtype=np.int16),
+    }
+
+
+def _to_mir_eval(arrays):
+    """转换为 mir_eval 需要的 (区间, 频率, 力度)，只保留钢琴音域内的音符。"""
+    pitch = arrays["pitch"]
+    keep = (pitch >= PIANO_PITCH_RANGE[0]) & (pitch <= PIANO_PITCH_RANGE[1])
+
+    onset = arrays["onset"][keep]
+    # mir_eval 要求音符时长为正
+    offset = np.maximum(arrays["offset"][keep], onset + 1e-3)
+    intervals = np.stack([onset, offset], axis=1).reshape(-1, 2)
+    pitches = mir_eval.util.midi_to_hz(pitch[keep].astype(np.float64))
+    velocities = arrays["velocity"][keep].astype(np.float64)
+    return intervals, pitches, velocities
+
+
+def compute_metrics(ref_arrays, est_arrays):
+    """
+    计算音符级别的 F1：仅起点、起点+终点、起点+终点+力度。
+    """
+    ref_intervals, ref_pitches, ref_velocities = _to_mir_eval(ref_arrays)
+    est_intervals, est_pitches, est_velocities = _to_mir_eval(est_arrays)
+
+    _, _, onset_f1, _ = mir_eval.transcription.precision_recall_f1_overlap(
+        ref_intervals, ref_pitches, est_intervals, est_pitches, offset_ratio=None)
+    _, _, onset_offset_f1, _ = mir_eval.transcription.precision_recall_f1_overlap(
+        ref_intervals, ref_pitches, est_intervals, est_pitches)
+    _, _, velocity_f1, _ = mir_eval.transcription_velocity.precision_recall_f1_overlap(
+        ref_intervals, ref_pitches, ref_velocities, est_intervals, est_pitches, est_velocities)
+
+    return {
+        "onset_f1": onset_f1,
+        "onset_offset_f1": onset_offset_f1,
+        "onset_offset_velocity_f1": velocity_f1,
+    }
+
+
+def _synchronize(device):
+    if device == "cuda":
+        torch.cuda.synchronize()
+
+
+def evaluate_config(model, conf, device, speed_profile, pairs):
+    """
+    用指定的设备和速度档位评测所有文件。
+
+    :return: 每个文件的结果列表。
+    """
+    segment_hop, segment_size = resolve_speed_profile(conf, speed_profile)
+    rows = []
+    for audio_path, midi_path in pairs:
+        start_time = time.time()
+        audio = read_audio(audio_path, model.fs)
+        x = torch.from_numpy(audio).to(device)
+
+        transcribe_start = time.time()
+        with torch.no_grad():
+            notes_est = model.transcribe(x, stepInSecond=segment_hop, segmentSizeInSecond=segment_size)
+        _synchronize(device)
+        end_time = time.time()
+
+        duration = audio.shape[0] / model.fs
+        transcribe_time = end_time - transcribe_start
+        row = {
+            "device": device,
+            "profile": speed_profile,
+            "file": Path(audio_path).name,
+            "audio_seconds": duration,
+            "wall_seconds": end_time - start_time,
+            "transcribe_seconds": transcribe_time,
+            "rtf": transcribe_time / duration if duration > 0 else 0.0,
+        }
+        row.update(compute_metrics(read_reference_midi(midi_path), notes_to_arrays(notes_est)))
+        rows.append(row)
+
+        print(f"[{device}/{speed_profile}] {row['file']}: RTF {row['rtf']:.3f}, "
+              f"onset F1 {row['onset_f1']:.4f}, onset+offset F1 {row['onset_offset_f1']:.4f}")
+    return rows
+
+
+def summarize(rows, configs):
+    """
+    汇总各配置的结果，并计算相对于同一设备上标准档位的加速比和 F1 差值。
+    """
+    summaries = []
+    for device, speed_profile in configs:
+        config_rows = [r for r in rows if r["device"] == device and r["profile"] == speed_profile]
+        if not config_rows:
+            continue
+        audio_seconds = sum(r["audio_seconds"] for r in config_rows)
+        transcribe_seconds = sum(r["transcribe_seconds"] for r in config_rows)
+        summary = {
+            "device": device,
+            "profile": speed_profile,
+            "files": len(config_rows),
+            "audio_seconds": audio_seconds,
+            "wall_seconds": sum(r["wall_seconds"] for r in config_rows),
+            "transcribe_seconds": transcribe_seconds,
+            "rtf": transcribe_seconds / audio_seconds if audio_seconds > 0 else 0.0,
+        }
+        # 各文件 F1 的平均值
+        for name in METRIC_NAMES:
+            summary[name] = float(np.mean([r[name] for r in config_rows]))
+        summaries.append(summary)
+
+    # 每个设备以该设备上的标准档位为基准（没有时用该设备的第一个配置），
+    # 使加速比和 F1 差值只反映档位的影响，不混入设备之间的差异
+    baselines = {}
+    for summary in summaries:
+        baselines.setdefault(summary["device"], summary)
+        if summary["profile"] == DEFAULT_SPEED_PROFILE:
+            baselines[summary["device"]] = summary
+
+    for summary in summaries:
+        baseline = baselines[summary["device"]]
+        summary["speedup"] = (baseline["transcribe_seconds"] / summary["transcribe_seconds"]
+                              if summary["transcribe_seconds"] > 0 else 0.0)
+        for name in METRIC_NAMES:
+            summary[f"delta_{name}"] = summary[name] - baseline[name]
+    return summaries
+
+
+def format_table(summaries):
+    """将汇总结果格式化为 Markdown 表格。"""
+    header = ("| 设备 | 档位 | 文件数 | 音频时长(s) | 总耗时(s) | RTF | 加速比 | "
+              "Onset F1 | Onset+Offset F1 | +Velocity F1 | ΔOnset F1 | ΔOnset+Offset F1 | Δ+Velocity F1 |")
+    lines = [header, "|" + "---|" * (header.count("|") - 1)]
+    for s in summaries:
+        lines.append(
+            f"| {s['device']} | {s['profile']} | {s['files']} | {s['audio_seconds']:.1f} | "
+            f"{s['wall_seconds']:.1f} | {s['rtf']:.3f} | {s['speedup']:.2f}× | "
+            f"{s['onset_f1']:.4f} | {s['onset_offset_f1']:.4f} | {s['onset_offset_velocity_f1']:.4f} | "
+            f"{s['delta_onset_f1']:+.4f} | {s['delta_onset_offset_f1']:+.4f} | "
+            f"{s['delta_onset_offset_velocity_f1']:+.4f} |"
+        )
+    return "\n".join(lines)
+
+
+def write_csv(rows, csv_path):
+    """保存每个文件的详细结果。"""
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在本地 音频+参考MIDI 数据集上评测不同配置的转录速度和精度")
+    parser.add_argument("data_dir", help="数据目录，音频与参考MIDI按文件名配对")
+    parser.add_argument("--profiles", nargs="+", default=list(SPEED_PROFILES.keys()),
+                        choices=list(SPEED_PROFILES.keys()), help="要评测的速度档位，各设备以标准档位作为基准")
+    parser.add_argument("--devices", nargs="+", default=["cuda" if cuda_available else "cpu"],
+                        choices=["cpu", "cuda"], help="要评测的设备")
+    parser.add_argument("--csv", default=None, help="保存每个文件详细结果的CSV路径")
+    parser.add_argument("--no-warmup", action="store_true", help="不进行预热")
+    args = parser.parse_args()
+
+    if "cuda" in args.devices and not cuda_available:
+        parser.error("CUDA 不可用")
+
+    pairs = find_pairs(args.data_dir)
+    if not pairs:
+        parser.error(f"在 {args.data_dir} 中没有找到 音频+参考MIDI 文件对")
+    print(f"找到 {len(pairs)} 个文件对")
+
+    # 基准档位放在最前面
+    profiles = list(args.profiles)
+    if DEFAULT_SPEED_PROFILE in profiles:
+        profiles.remove(DEFAULT_SPEED_PROFILE)
+        profiles.insert(0, DEFAULT_SPEED_PROFILE)
+    configs = [(device, profile) for device in args.devices for profile in profiles]
+
+    rows = []
+    for device in args.devices:
+        model, conf = load_model(device, use_cache=False)
+
+        if not args.no_warmup:
+            audio = read_audio(pairs[0][0], model.fs)[:WARMUP_SECONDS * model.fs]
+            with torch.no_grad():
+                model.transcribe(torch.from_numpy(audio).to(device))
+            _synchronize(device)
+
+        for profile in profiles:
+            rows.extend(evaluate_config(model, conf, device, profile, pairs))
+
+        del model
+        if device == "cuda":
+            torch.cuda.empty_cache()
+
+    print()
+    print(format_table(summarize(rows, configs)))
+
+    if args.csv:
+        write_csv(rows, args.csv)
+        print(f"\n详细结果已保存到 {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,20 @@
 import os
+import math
 import time
 import torch
 import gradio as gr
 import threading
 import traceback
+import subprocess
+import heapq
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import moduleconf
 import transkun.transcribe
 from pathlib import Path
 import tempfile
 import shutil
+from note_export import save_notes
 
 os.environ['NO_PROXY'] = "localhost, 127.0.0.1, ::1"
 
@@ -23,6 +29,9 @@ if ffmpeg_bin_path not in os.environ['PATH'].split(os.pathsep):
 # 检查CUDA是否可用
 cuda_available = torch.cuda.is_available()
 
+# 支持的音频文件扩展名（命令行工具按扩展名筛选输入文件）
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".ogg", ".m4a", ".opus", ".aac")
+
 import mido
 from collections import defaultdict, Counter
 
@@ -296,8 +305,456 @@ def trim_midi_silence(mid, debug=False):
         if debug:
             print(f"MIDI裁剪失败: {e}")
 
+# 转录任务被取消时抛出
+class TranscriptionCancelled(Exception):
+    pass
+
+# 服务器运行统计：完成/取消的文件数，以及取消后节省下来的计算时间（估算）
+_metrics_lock = threading.Lock()
+server_metrics = {
+    "completed_files": 0,
+    "cancelled_jobs": 0,
+    "cancelled_files": 0,
+    "reclaimed_compute_seconds": 0.0,
+}
+
+def record_metrics(**deltas):
+    """
+    累加服务器统计数据。
+    """
+    with _metrics_lock:
+        for key, value in deltas.items():
+            server_metrics[key] += value
+
+def format_server_metrics():
+    """
+    将服务器统计数据格式化为文本。
+    """
+    with _metrics_lock:
+        snapshot = dict(server_metrics)
+    return (
+        f"已完成文件: {snapshot['completed_files']}\n"
+        f"已取消任务: {snapshot['cancelled_jobs']}\n"
+        f"已取消文件: {snapshot['cancelled_files']}\n"
+        f"回收的计算时间（估算）: {snapshot['reclaimed_compute_seconds']:.1f}秒"
+    )
+
+# 每个会话正在运行的批量任务的取消标志
+_active_jobs = {}
+_active_jobs_lock = threading.Lock()
+
+def cancel_session_job(session_hash):
+    """
+    取消指定会话正在运行的任务。
+
+    :return: 是否找到了正在运行的任务。
+    """
+    with _active_jobs_lock:
+        cancel_event = _active_jobs.get(session_hash)
+    if cancel_event is None:
+        return False
+    cancel_event.set()
+    return True
+
+# transkun 的 model.transcribe 在内部逐段调用 processFramesBatch 进行推理，
+# 在这里包一层，以便在分段之间检查取消标志、统计完成的分段数。
+# 回调保存在线程局部变量中，多个线程共享同一个模型时互不干扰。
+_segment_state = threading.local()
+
+def install_segment_hook(model):
+    """
+    为模型安装分段回调。回调以 callback(done) 的形式调用：
+    每段推理开始前 done=False，结束后 done=True。
+    """
+    original = getattr(model, "processFramesBatch", None)
+    if original is None or getattr(original, "_segment_hooked", False):
+        return model
+
+    def hooked(*args, **kwargs):
+        callback = getattr(_segment_state, "callback", None)
+        if callback is not None:
+            callback(False)
+        result = original(*args, **kwargs)
+        if callback is not None:
+            callback(True)
+        return result
+
+    hooked._segment_hooked = True
+    model.processFramesBatch = hooked
+    return model
+
+def count_segments(conf, num_samples, hop_seconds=None, segment_seconds=None):
+    """
+    计算 model.transcribe 对给定长度的音频需要推理的分段数，与 transkun 的分段方式一致。
+
+    :param conf: 模型配置。
+    :param num_samples: 重采样后的音频采样点数。
+    :param hop_seconds: 分段步长（秒），默认使用配置文件中的值。
+    :param segment_seconds: 分段长度（秒），默认使用配置文件中的值。
+    """
+    if hop_seconds is None:
+        hop_seconds = conf.segmentHopSizeInSecond
+    if segment_seconds is None:
+        segment_seconds = conf.segmentSizeInSecond
+
+    pad_seconds = segment_seconds - hop_seconds
+    padded_samples = num_samples + 2 * math.ceil(pad_seconds * conf.fs)
+    step_samples = math.ceil(hop_seconds * conf.fs / conf.hopSize) * conf.hopSize
+    return max(1, math.ceil(padded_samples / step_samples))
+
+# 推理速度档位：覆盖配置文件中的分段长度和步长（秒），None 表示使用配置文件中的值。
+# 每个分段都要完整推理一次，吞吐量大致与步长成正比（默认 16 秒分段、8 秒步长，
+# 几乎每秒音频都要推理两次）。
+SPEED_PROFILES = {
+    "standard": {"label": "标准（精度最高）", "segment_size": None, "segment_hop": None},
+    "fast": {"label": "快速（重叠4秒）", "segment_size": 16, "segment_hop": 12},
+    "draft": {"label": "草稿（重叠2秒）", "segment_size": 16, "segment_hop": 14},
+}
+DEFAULT_SPEED_PROFILE = "standard"
+
+# 相邻分段之间至少保留的重叠（秒）。transkun 依靠重叠区域拼接跨越分段边界的音符，
+# 重叠太小时边界附近的音符缺少上下文，容易被截断或重复。
+# 这个下限是保守的经验值，各档位实际的精度损失需要用 evaluate.py 测量。
+MIN_SEGMENT_OVERLAP = 2.0
+
+def resolve_speed_profile(conf, speed_profile=DEFAULT_SPEED_PROFILE):
+    """
+    根据速度档位计算实际使用的分段步长和分段长度。
+
+    :param conf: 模型配置。
+    :param speed_profile: 速度档位名称，见 SPEED_PROFILES。
+    :return: (分段步长, 分段长度)，单位为秒。
+    """
+    if speed_profile not in SPEED_PROFILES:
+        raise ValueError(f"未知的速度档位: {speed_profile}")
+
+    profile = SPEED_PROFILES[speed_profile]
+    segment_size = profile["segment_size"] or conf.segmentSizeInSecond
+    segment_hop = profile["segment_hop"] or conf.segmentHopSizeInSecond
+
+    if segment_hop <= 0 or segment_size - segment_hop < MIN_SEGMENT_OVERLAP:
+        raise ValueError(
+            f"速度档位 {speed_profile} 的分段设置无效：分段长度 {segment_size} 秒，步长 {segment_hop} 秒，"
+            f"相邻分段至少需要重叠 {MIN_SEGMENT_OVERLAP} 秒"
+        )
+    return segment_hop, segment_size
+
+# 单个文件处理过程中各阶段对应的进度（0~1），推理阶段按完成的分段数在区间内推进
+PROGRESS_DECODE = 0.05
+PROGRESS_INFERENCE_START = 0.1
+PROGRESS_INFERENCE_END = 0.9
+PROGRESS_QUANTIZE = 0.95
+
+# 还没有实测数据时使用的实时率（处理耗时 / 音频时长）初始值
+DEFAULT_RTF = {"cpu": 1.0, "cuda": 0.1}
+# 实时率滑动平均的权重，越大越偏向最近的文件
+RTF_SMOOTHING = 0.3
+
+# 按 (设备, 速度档位, 并行任务数) 记录的实时率滑动平均。
+# 多个文件同时处理时共享同一个CPU/GPU，单个文件的处理耗时包含了争用，
+# 所以不同并行任务数的实时率分开记录，互不污染。
+_rtf_estimates = {}
+_rtf_lock = threading.Lock()
+
+def update_rtf(device, speed_profile, process_seconds, audio_seconds, slots=1):
+    """
+    用一个文件的实际处理耗时更新实时率估计。
+
+    :param slots: 处理这个文件时同时运行的任务数。
+    """
+    if audio_seconds <= 0:
+        return
+    rtf = process_seconds / audio_seconds
+    key = (device, speed_profile, slots)
+    with _rtf_lock:
+        if key in _rtf_estimates:
+            _rtf_estimates[key] += RTF_SMOOTHING * (rtf - _rtf_estimates[key])
+        else:
+            _rtf_estimates[key] = rtf
+
+def estimate_rtf(device, speed_profile=DEFAULT_SPEED_PROFILE, slots=1):
+    """
+    获取当前的实时率估计（单个文件的处理耗时 / 音频时长）。
+    该并行任务数还没有实测数据时，保守地假设各任务平分设备：
+    用单任务的实时率（没有时用初始值）乘以并行任务数。
+
+    :param slots: 同时运行的任务数。
+    """
+    with _rtf_lock:
+        if (device, speed_profile, slots) in _rtf_estimates:
+            return _rtf_estimates[(device, speed_profile, slots)]
+        single = _rtf_estimates.get((device, speed_profile, 1), DEFAULT_RTF.get(device, 1.0))
+    return single * slots
+
+def probe_duration(input_file):
+    """
+    用 ffprobe 读取音频时长（秒），只读取元数据，不解码音频。
+
+    :return: 音频时长，读取失败时返回 None。
+    """
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", str(input_file)],
+            capture_output=True, text=True, timeout=30, check=True,
+            # Windows下不弹出控制台窗口
+            creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0)
+        )
+        duration = float(result.stdout.strip())
+        return duration if duration > 0 else None
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+
+def format_eta(seconds):
+    """
+    将剩余时间格式化为文本。
+    """
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}秒"
+    if seconds < 3600:
+        return f"{seconds // 60}分{seconds % 60:02d}秒"
+    return f"{seconds // 3600}小时{seconds % 3600 // 60:02d}分"
+
+class BatchProgress:
+    """
+    批量任务的进度：各文件按音频时长加权，剩余时间按计划的处理顺序把剩余工作
+    分配到各并行槽位上模拟得出，再乘以实时率。
+    每个文件通过 reporter(i) 得到一个与 gr.Progress 调用方式相同的回调。
+    """
+
+    def __init__(self, progress, file_names, durations, device, speed_profile=DEFAULT_SPEED_PROFILE,
+                 slots=1, schedule=None):
+        """
+        :param progress: Gradio进度条对象。
+        :param file_names: 各文件的名称，用于显示。
+        :param durations: 各文件的音频时长（秒），未知的为 None。
+        :param device: 运行设备。
+        :param speed_profile: 推理速度档位。
+        :param slots: 并行槽位数。
+        :param schedule: 文件下标的处理顺序，默认按上传顺序；可以在创建后再设置。
+        """
+        known = [d for d in durations if d]
+        fallback = sum(known) / len(known) if known else 1.0
+        self.progress = progress
+        self.file_names = file_names
+        self.durations = [d if d else fallback for d in durations]
+        self.device = device
+        self.speed_profile = speed_profile
+        self.fractions = [0.0] * len(durations)
+        self.slots = max(1, slots)
+        self.schedule = list(schedule) if schedule is not None else list(range(len(durations)))
+        # 已经开始处理的文件
+        self.started = set()
+        self.lock = threading.Lock()
+
+    def remaining_seconds(self):
+        """
+        估算剩余处理时间（秒）：正在处理的文件占用各自的槽位，
+        未开始的文件按计划顺序依次分配给最先空闲的槽位。
+        """
+        remaining = [d * (1.0 - f) for d, f in zip(self.durations, self.fractions)]
+        running = [remaining[i] for i in self.started if self.fractions[i] < 1.0]
+        waiting = [remaining[i] for i in self.schedule if i not in self.started]
+        makespan = simulate_makespan(waiting, self.slots, initial_loads=running)
+        return makespan * estimate_rtf(self.device, self.speed_profile, self.slots)
+
+    def update(self, index, fraction, desc=None):
+        """
+        更新第 index 个文件的进度并刷新进度条。
+        """
+        with self.lock:
+            self.started.add(index)
+            self.fractions[index] = min(max(fraction, 0.0), 1.0)
+            total = sum(self.durations)
+            overall = sum(d * f for d, f in zip(self.durations, self.fractions)) / total
+            eta = self.remaining_seconds()
+
+        prefix = f"[{index + 1}/{len(self.durations)}] {self.file_names[index]}"
+        text = f"{prefix}: {desc}" if desc else prefix
+        self.progress(overall, desc=f"{text}（预计剩余 {format_eta(eta)}）")
+
+    def finish(self, index):
+        """
+        标记第 index 个文件已结束（无论成功、失败还是取消），
+        之后它不再占用并行槽位，也不再计入剩余时间。
+        """
+        with self.lock:
+            self.started.add(index)
+            self.fractions[index] = 1.0
+
+    def reporter(self, index):
+        """
+        返回第 index 个文件的进度回调。
+        """
+        def report(fraction, desc=None):
+            self.update(index, fraction, desc)
+        return report
+
+# 批量任务的处理顺序
+SCHEDULE_ORDERS = {
+    "longest": "总用时最短（长文件优先）",
+    "shortest": "最快出结果（短文件优先）",
+    "upload": "上传顺序",
+}
+DEFAULT_SCHEDULE_ORDER = "longest"
+# 界面上允许的最大并行任务数
+MAX_PARALLEL_JOBS = 4
+
+def simulate_makespan(durations, slots=1, initial_loads=()):
+    """
+    模拟按顺序把任务交给最先空闲的槽位，返回全部完成所需的时间。
+
+    :param durations: 按处理顺序排列的任务时长。
+    :param slots: 并行槽位数。
+    :param initial_loads: 各槽位上正在运行的任务的剩余时长。
+    :return: 总用时，与 durations 单位相同。
+    """
+    finish_times = list(initial_loads)[:max(1, slots)]
+    finish_times += [0.0] * (max(1, slots) - len(finish_times))
+    heapq.heapify(finish_times)
+    for duration in durations:
+        heapq.heapreplace(finish_times, finish_times[0] + duration)
+    return max(finish_times)
+
+def plan_schedule(durations, order=DEFAULT_SCHEDULE_ORDER, slots=1):
+    """
+    安排批量任务的处理顺序，并预测总用时（makespan）。
+    任务按顺序交给最先空闲的并行槽位；长文件优先（LPT）时总用时接近最优，
+    短文件优先时最先得到结果。
+
+    :param durations: 各文件的处理时长估计（任意单位，例如音频时长）。
+    :param order: 处理顺序，见 SCHEDULE_ORDERS。
+    :param slots: 并行槽位数。
+    :return: (文件下标的处理顺序, 预测的总用时)，总用时与 durations 单位相同。
+    """
+    indices = list(range(len(durations)))
+    if order == "longest":
+        indices.sort(key=lambda i: durations[i], reverse=True)
+    elif order == "shortest":
+        indices.sort(key=lambda i: durations[i])
+    elif order != "upload":
+        raise ValueError(f"未知的处理顺序: {order}")
+
+    return indices, simulate_makespan([durations[i] for i in indices], slots)
+
+# 模型文件路径
+MODEL_WEIGHT_PATH = os.path.join(current_dir, "models", "2.0.pt")
+MODEL_CONF_PATH = os.path.join(current_dir, "models", "2.0.conf")
+
+# 转换后的权重文件：只保存 state_dict，使用可以内存映射的序列化格式。
+# 加载时张量直接引用文件映射的只读页，不需要完整反序列化和复制，
+# 同一台机器上的多个进程共享同一份物理内存（页缓存）。
+MODEL_MMAP_WEIGHT_PATH = os.path.join(current_dir, "models", "2.0.mmap.pt")
+
+# 已加载的模型，按设备缓存，避免每个文件都重新加载
+_model_cache = {}
+_model_cache_lock = threading.Lock()
+
+def convert_checkpoint(src_path=MODEL_WEIGHT_PATH, dst_path=MODEL_MMAP_WEIGHT_PATH):
+    """
+    将原始检查点转换为可以内存映射加载的权重文件，只需要执行一次。
+
+    :param src_path: 原始检查点路径。
+    :param dst_path: 转换后的权重文件路径。
+    :return: 转换后的权重文件路径。
+    """
+    checkpoint = torch.load(src_path, map_location="cpu")
+    if "best_state_dict" not in checkpoint:
+        state_dict = checkpoint["state_dict"]
+    else:
+        state_dict = checkpoint["best_state_dict"]
+    state_dict = {name: tensor.contiguous() for name, tensor in state_dict.items()}
+
+    # 先写到同一目录下的唯一临时文件再替换，多个进程同时转换时互不覆盖，
+    # 也不会有进程读到写了一半的文件
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(dst_path), suffix=".tmp")
+    os.close(fd)
+    try:
+        torch.save(state_dict, temp_path)
+        os.replace(temp_path, dst_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return dst_path
+
+def _load_mmap_state_dict():
+    """
+    以内存映射方式加载权重，必要时先进行转换。失败时返回 None。
+    """
+    try:
+        if (not os.path.exists(MODEL_MMAP_WEIGHT_PATH) or
+                os.path.getmtime(MODEL_MMAP_WEIGHT_PATH) < os.path.getmtime(MODEL_WEIGHT_PATH)):
+            convert_checkpoint()
+        return torch.load(MODEL_MMAP_WEIGHT_PATH, map_location="cpu", mmap=True, weights_only=True)
+    except Exception as e:
+        # 旧版本PyTorch不支持mmap，或模型目录不可写（如打包后的程序），回退到普通加载
+        print(f"内存映射加载权重失败，使用普通方式加载: {str(e)}")
+        return None
+
+def load_model(device, use_mmap=True, use_cache=True):
+    """
+    加载模型和配置。
+
+    :param device: 运行设备（"cuda" 或 "cpu"）。
+    :param use_mmap: 是否以内存映射方式加载权重。
+    :param use_cache: 是否复用已加载的模型。
+    :return: (模型, 模型配置)。
+    """
+    # 检查模型文件是否存在
+    if not os.path.exists(MODEL_WEIGHT_PATH) or not os.path.exists(MODEL_CONF_PATH):
+        raise FileNotFoundError(
+            f"找不到模型文件！请确保以下文件存在：\n"
+            f"{MODEL_WEIGHT_PATH}\n"
+            f"{MODEL_CONF_PATH}"
+        )
+
+    with _model_cache_lock:
+        if use_cache and device in _model_cache:
+            return _model_cache[device]
+
+        # 加载配置
+        conf_manager = moduleconf.parseFromFile(MODEL_CONF_PATH)
+        TransKun = conf_manager["Model"].module.TransKun
+        conf = conf_manager["Model"].config
+
+        # 加载模型
+        model = TransKun(conf=conf).to(device)
+        state_dict = _load_mmap_state_dict() if use_mmap else None
+        if state_dict is not None:
+            # CPU上直接使用映射的张量作为模型参数（assign=True），不复制权重；
+            # CUDA上从映射的页直接拷贝到显存
+            model.load_state_dict(state_dict, strict=False, assign=(device == "cpu"))
+        else:
+            checkpoint = torch.load(MODEL_WEIGHT_PATH, map_location=device)
+            if "best_state_dict" not in checkpoint:
+                model.load_state_dict(checkpoint["state_dict"], strict=False)
+            else:
+                model.load_state_dict(checkpoint["best_state_dict"], strict=False)
+        model.eval()
+        install_segment_hook(model)
+
+        if use_cache:
+            _model_cache[device] = (model, conf)
+        return model, conf
+
+def read_audio(input_file, fs):
+    """
+    读取音频文件并重采样到模型的采样率。
+
+    :param input_file: 输入音频文件路径。
+    :param fs: 目标采样率。
+    :return: 形状为 (采样点数, 声道数) 的numpy数组。
+    """
+    audio_fs, audio = transkun.transcribe.readAudio(input_file)
+    if audio_fs != fs:
+        import soxr
+        audio = soxr.resample(audio, audio_fs, fs)
+    return audio
+
 # 核心转换函数
-def process_audio(input_file, use_cuda=True, use_quantize=True, progress=gr.Progress(), file_progress_offset=0.0, file_progress_scale=1.0):
+def process_audio(input_file, use_cuda=True, use_quantize=True, progress=gr.Progress(), file_progress_offset=0.0, file_progress_scale=1.0, note_formats=(), cancel_event=None, speed_profile=DEFAULT_SPEED_PROFILE, parallel_jobs=1):
     """
     处理音频文件并生成MIDI文件。
 
@@ -307,9 +764,34 @@ def process_audio(input_file, use_cuda=True, use_quantize=True, progress=gr.Prog
     :param progress: Gradio进度条对象。
     :param file_progress_offset: 进度条的起始偏移量，用于批量处理。
     :param file_progress_scale: 进度条的缩放比例，用于批量处理。
+    :param note_formats: 额外导出的音符数据格式（npz/notes/jsonl），直接由转录结果写出。
+    :param cancel_event: 取消标志（threading.Event），被设置后会在文件的各阶段之间、推理分段之间停止处理。
+    :param speed_profile: 推理速度档位，见 SPEED_PROFILES。
+    :param parallel_jobs: 同时处理的文件数，用于分开记录实时率。
     :return: 包含处理结果的字典。
     """
     temp_dir = None
+    device = "cpu"
+    # 推理分段的完成情况，用于估算取消时节省下来的计算时间
+    segment_stats = {"total": 0, "done": 0, "started_at": None}
+    # 解码后的音频时长（秒），解码之前为 None
+    audio_seconds = None
+
+    def check_cancelled():
+        if cancel_event is not None and cancel_event.is_set():
+            raise TranscriptionCancelled()
+
+    def on_segment(done):
+        if done:
+            segment_stats["done"] += 1
+            # 推理阶段的进度按完成的分段数推进
+            fraction = PROGRESS_INFERENCE_START + (PROGRESS_INFERENCE_END - PROGRESS_INFERENCE_START) * \
+                min(1.0, segment_stats["done"] / max(1, segment_stats["total"]))
+            progress(file_progress_offset + fraction * file_progress_scale,
+                     desc=f"转录中（{segment_stats['done']}/{segment_stats['total']}）...")
+        else:
+            check_cancelled()
+
     try:
         # The fix: create a temporary directory to store all output files
         # 修复：创建一个临时目录来存储所有的输出文件
@@ -331,53 +813,43 @@ def process_audio(input_file, use_cuda=True, use_quantize=True, progress=gr.Prog
         progress(file_progress_offset, desc="准备模型...")
 
         # 加载模型和配置
-        default_weight = os.path.join(current_dir, "models\\2.0.pt")
-        default_conf = os.path.join(current_dir, "models\\2.0.conf")
+        model, conf = load_model(device)
+        segment_hop, segment_size = resolve_speed_profile(conf, speed_profile)
 
-        # 检查模型文件是否存在
-        if not os.path.exists(default_weight) or not os.path.exists(default_conf):
-            raise FileNotFoundError(
-                f"找不到模型文件！请确保以下文件存在：\n"
-                f"{default_weight}\n"
-                f"{default_conf}"
-            )
-
-        # 加载配置
-        conf_manager = moduleconf.parseFromFile(default_conf)
-        TransKun = conf_manager["Model"].module.TransKun
-        conf = conf_manager["Model"].config
-
-        # 加载模型
-        checkpoint = torch.load(default_weight, map_location=device)
-        model = TransKun(conf=conf).to(device)
-        if "best_state_dict" not in checkpoint:
-            model.load_state_dict(checkpoint["state_dict"], strict=False)
-        else:
-            model.load_state_dict(checkpoint["best_state_dict"], strict=False)
-        model.eval()
-
-        progress(file_progress_offset + 0.2 * file_progress_scale, desc="读取音频...")
-        # 读取并处理音频
-        fs, audio = transkun.transcribe.readAudio(input_file)
-        if fs != model.fs:
-            import soxr
-            audio = soxr.resample(audio, fs, model.fs)
+        check_cancelled()
+        progress(file_progress_offset + PROGRESS_DECODE * file_progress_scale, desc="读取音频...")
+        # 读取并处理音频，实时率从这里开始计时，不包含模型加载
+        rtf_start_time = time.time()
+        audio = read_audio(input_file, model.fs)
+        audio_seconds = audio.shape[0] / model.fs
 
         x = torch.from_numpy(audio).to(device)
 
-        progress(file_progress_offset + 0.4 * file_progress_scale, desc="转录中...")
+        check_cancelled()
+        progress(file_progress_offset + PROGRESS_INFERENCE_START * file_progress_scale, desc="转录中...")
         # 转录
+        segment_stats["total"] = count_segments(conf, audio.shape[0], segment_hop, segment_size)
+        segment_stats["started_at"] = time.time()
+        _segment_state.callback = on_segment
         with torch.no_grad():
-            notes_est = model.transcribe(x)
+            notes_est = model.transcribe(x, stepInSecond=segment_hop, segmentSizeInSecond=segment_size)
+        _segment_state.callback = None
 
-        progress(file_progress_offset + 0.7 * file_progress_scale, desc="保存MIDI...")
+        check_cancelled()
+
+        progress(file_progress_offset + PROGRESS_INFERENCE_END * file_progress_scale, desc="保存MIDI...")
         # 保存MIDI到临时目录，将 Path 对象转换为字符串
         output_midi = transkun.transcribe.writeMidi(notes_est)
         output_midi.write(str(output_file))
 
+        # 导出音符数据，直接使用转录结果，不经过MIDI
+        note_files = []
+        if note_formats:
+            note_files = save_notes(notes_est, Path(temp_dir) / input_name, note_formats)
+
         # 如果勾选了规整化选项，则进行MIDI规整化
         if use_quantize:
-            progress(file_progress_offset + 0.8 * file_progress_scale, desc="规整化MIDI...")
+            progress(file_progress_offset + PROGRESS_QUANTIZE * file_progress_scale, desc="规整化MIDI...")
             try:
                 # The midi_quantize function will now write the output file with the expected name
                 # midi_quantize函数现在将以预期的名称写入输出文件
@@ -388,25 +860,54 @@ def process_audio(input_file, use_cuda=True, use_quantize=True, progress=gr.Prog
 
         end_time = time.time()
         process_time = round(end_time - start_time, 2)
+        update_rtf(device, speed_profile, end_time - rtf_start_time, audio_seconds, parallel_jobs)
 
         progress(file_progress_offset + 1.0 * file_progress_scale, desc="完成！")
+        record_metrics(completed_files=1)
 
         # 返回结果
         result_files = [str(output_file)]
         if quantized_output_file:
             result_files.append(quantized_output_file)
+        result_files.extend(note_files)
 
         return {
             "output": f"转换完成！用时 {process_time}秒",
             "files": result_files
         }
 
+    except TranscriptionCancelled:
+        # 按已完成分段的平均耗时估算剩余分段本来要占用的计算时间；
+        # 还没有分段完成时（加载模型、解码或第一段推理期间取消），按音频时长和实时率估算
+        if segment_stats["done"] > 0:
+            per_segment = (time.time() - segment_stats["started_at"]) / segment_stats["done"]
+            reclaimed = per_segment * max(0, segment_stats["total"] - segment_stats["done"])
+        else:
+            duration = audio_seconds if audio_seconds is not None else probe_duration(input_file)
+            reclaimed = (duration or 0.0) * estimate_rtf(device, speed_profile)
+
+        # 立即释放未完成的输出和显存
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        if device == "cuda":
+            torch.cuda.empty_cache()
+
+        record_metrics(cancelled_files=1, reclaimed_compute_seconds=reclaimed)
+        return {
+            "output": "已取消",
+            "files": [],
+            "cancelled": True
+        }
+
     except Exception as e:
         traceback.print_exc()
         return {
             "output": f"转换失败: {str(e)}",
             "files": []
         }
+
+    finally:
+        _segment_state.callback = None
     # Removed the manual cleanup block, Gradio will handle this now.
     # 删除了手动清理代码块，现在由 Gradio 来处理。
 
@@ -440,7 +941,39 @@ def create_interface():
                     info="基于简单的算法，不会影响扒谱的精确性"
                 )
 
-                convert_btn = gr.Button("开始转换", variant="primary")
+                speed_profile = gr.Radio(
+                    label="推理速度",
+                    choices=[(profile["label"], name) for name, profile in SPEED_PROFILES.items()],
+                    value=DEFAULT_SPEED_PROFILE,
+                    info="快速/草稿档位减少相邻分段的重叠，推理的分段更少、速度更快，但精度可能下降，适合打草稿"
+                )
+
+                note_formats = gr.CheckboxGroup(
+                    label="额外导出音符数据（可选）",
+                    choices=[("NPZ", "npz"), ("二进制 .notes（可内存映射）", "notes"), ("JSONL", "jsonl")],
+                    value=[],
+                    info="直接保存转录出的音符起止时间、音高和力度，不经过MIDI，保留原始时间精度"
+                )
+
+                with gr.Row():
+                    schedule_order = gr.Radio(
+                        label="批量处理顺序",
+                        choices=[(label, name) for name, label in SCHEDULE_ORDERS.items()],
+                        value=DEFAULT_SCHEDULE_ORDER,
+                        info="按音频时长安排顺序：长文件优先时整批完成最快，短文件优先时最先拿到结果"
+                    )
+                    parallel_jobs = gr.Slider(
+                        label="并行任务数",
+                        minimum=1,
+                        maximum=MAX_PARALLEL_JOBS,
+                        step=1,
+                        value=1,
+                        info="同时处理的文件数，内存或显存充足时可以调大"
+                    )
+
+                with gr.Row():
+                    convert_btn = gr.Button("开始转换", variant="primary")
+                    cancel_btn = gr.Button("取消", variant="stop")
 
             with gr.Column(scale=1):
                 # 输出部分
@@ -455,31 +988,108 @@ def create_interface():
                     download_all_btn = gr.Button("一键下载全部文件", variant="secondary", visible=False)
                     download_status = gr.Textbox(label="下载状态", value="", visible=False, interactive=False)
 
+                with gr.Accordion("服务器统计", open=False):
+                    metrics_output = gr.Textbox(label="统计", value=format_server_metrics, interactive=False, lines=4)
+                    refresh_metrics_btn = gr.Button("刷新", variant="secondary")
+
         # 处理函数
-        def on_convert(audio_paths, use_cuda, use_quantize, progress=gr.Progress()):
+        def on_convert(audio_paths, use_cuda, use_quantize, speed_profile, note_formats, schedule_order, parallel_jobs,
+                       request: gr.Request, progress=gr.Progress()):
             if not audio_paths:
-                return "请选择输入音频文件", [], gr.update(visible=False)
+                return "请选择输入音频文件", [], gr.update(visible=False), gr.update(visible=False), []
+
+            # 注册取消标志，取消按钮和页面关闭时都会设置它
+            session_hash = request.session_hash if request is not None else None
+            cancel_event = threading.Event()
+            if session_hash is not None:
+                with _active_jobs_lock:
+                    _active_jobs[session_hash] = cancel_event
 
-            all_files = []
-            results = []
             total_files = len(audio_paths)
+            parallel_jobs = max(1, min(int(parallel_jobs), total_files))
+
+            # 先用 ffprobe 读取各文件的时长，进度按音频时长加权，并据此安排处理顺序
+            progress(0.0, desc="读取音频信息...")
+            file_names = [Path(audio_path).name for audio_path in audio_paths]
+            durations = [probe_duration(audio_path) for audio_path in audio_paths]
+            device = "cuda" if use_cuda and cuda_available else "cpu"
+            batch_progress = BatchProgress(progress, file_names, durations, device, speed_profile,
+                                           slots=parallel_jobs)
+
+            schedule, predicted_audio = plan_schedule(batch_progress.durations, schedule_order, parallel_jobs)
+            batch_progress.schedule = schedule
+            predicted_time = predicted_audio * estimate_rtf(device, speed_profile, parallel_jobs)
+
+            # 各文件的处理结果，按上传顺序保存；未开始的文件为 None
+            file_results = [None] * total_files
 
-            for i, audio_path in enumerate(audio_paths):
-                file_name = Path(audio_path).name
-                progress_offset = (i / total_files)
-                progress_scale = (1 / total_files) * 0.9
+            def run_file(i):
+                if cancel_event.is_set():
+                    return
+                batch_progress.update(i, 0.0, "开始处理...")
+                try:
+                    file_results[i] = process_audio(audio_paths[i], use_cuda, use_quantize, batch_progress.reporter(i),
+                                                    note_formats=note_formats,
+                                                    cancel_event=cancel_event,
+                                                    speed_profile=speed_profile,
+                                                    parallel_jobs=parallel_jobs)
+                finally:
+                    # 失败或取消时 process_audio 不会报告完成，这里统一标记，避免剩余时间一直算上这个文件
+                    batch_progress.finish(i)
+
+            batch_start = time.time()
+            try:
+                # 按计划的顺序提交，空闲的工作线程依次取下一个文件。
+                # 线程池不会复制 contextvars，而 gr.Progress 要通过它找到当前事件，
+                # 所以每个任务都在复制的上下文中运行，否则进度更新会被丢弃
+                with ThreadPoolExecutor(max_workers=parallel_jobs) as executor:
+                    futures = [executor.submit(contextvars.copy_context().run, run_file, i) for i in schedule]
+                    for future in futures:
+                        future.result()
+            finally:
+                if session_hash is not None:
+                    with _active_jobs_lock:
+                        if _active_jobs.get(session_hash) is cancel_event:
+                            del _active_jobs[session_hash]
+            actual_time = time.time() - batch_start
 
-                progress(progress_offset, desc=f"处理文件 {i+1}/{total_files}: {file_name}")
-                result = process_audio(audio_path, use_cuda, use_quantize, progress,
-                                      file_progress_offset=progress_offset,
-                                      file_progress_scale=progress_scale)
-                results.append(result["output"])
+            all_files = []
+            results = []
+            for i in schedule:
+                result = file_results[i]
+                if result is None or result.get("cancelled"):
+                    continue
+                results.append(f"{file_names[i]}: {result['output']}")
                 all_files.extend(result["files"])
 
-            progress(1.0, desc="全部完成！")
             download_btn_update = gr.update(visible=True) if all_files else gr.update(visible=False)
             download_status_update = gr.update(visible=False)
-            return f"转换完成！共处理 {total_files} 个文件\n" + "\n".join(results), all_files, download_btn_update, download_status_update, all_files
+            makespan_info = f"预计总用时 {format_eta(predicted_time)}，实际总用时 {format_eta(actual_time)}"
+
+            finished_files = sum(1 for r in file_results if r is not None and not r.get("cancelled"))
+            if finished_files < total_files:
+                # 中途被打断的文件已在 process_audio 中计入统计，
+                # 未开始的文件按音频时长和实时率估算节省的计算时间
+                skipped = [i for i in range(total_files) if file_results[i] is None]
+                skipped_audio = sum(batch_progress.durations[i] for i in skipped)
+                record_metrics(cancelled_jobs=1, cancelled_files=len(skipped),
+                               reclaimed_compute_seconds=skipped_audio * estimate_rtf(device, speed_profile))
+                status = f"已取消！完成 {finished_files}/{total_files} 个文件，{makespan_info}\n" + "\n".join(results)
+                return status, all_files, download_btn_update, download_status_update, all_files
+
+            progress(1.0, desc="全部完成！")
+            status = f"转换完成！共处理 {total_files} 个文件，{makespan_info}\n" + "\n".join(results)
+            return status, all_files, download_btn_update, download_status_update, all_files
+
+        # 取消当前会话的转换任务
+        def on_cancel(request: gr.Request):
+            if cancel_session_job(request.session_hash):
+                return "正在取消..."
+            return "没有正在进行的转换任务"
+
+        # 页面关闭或断开连接时取消该会话的任务，释放计算资源
+        def on_unload(request: gr.Request):
+            cancel_session_job(request.session_hash)
 
         # 下载所有文件的函数
         def download_all_files(file_paths, status_output=None):
@@ -513,10 +1123,16 @@ def create_interface():
         # 绑定按钮事件
         convert_btn.click(
             fn=on_convert,
-            inputs=[input_audio, use_cuda, use_quantize],
+            inputs=[input_audio, use_cuda, use_quantize, speed_profile, note_formats, schedule_order, parallel_jobs],
             outputs=[status_output, file_output, download_all_btn, download_status, file_paths_store]
         )
 
+        # 绑定取消按钮事件，不进入队列，保证转换进行中也能立即响应
+        cancel_btn.click(fn=on_cancel, inputs=None, outputs=status_output, queue=False)
+        app.unload(on_unload)
+
+        refresh_metrics_btn.click(fn=format_server_metrics, inputs=None, outputs=metrics_output, queue=False)
+
         # 绑定下载按钮事件
         download_all_btn.click(
             fn=download_all_files,
@@ -0,0 +1,188 @@
+import json
+import numpy as np
+
+# 音符数据导出：直接从 model.transcribe 返回的音符对象写出列式数据，
+# 不经过 writeMidi，保留原始的秒级浮点时间（不会被量化到MIDI tick）。
+#
+# 支持三种格式：
+#   npz   - numpy 标准格式，方便在脚本里直接 np.load
+#   notes - 固定布局的二进制文件，可以内存映射（零拷贝读取）
+#   jsonl - 每行一个音符的JSON，方便其它工具处理
+
+NOTE_FORMATS = ("npz", "notes", "jsonl")
+
+# 各列的名称及存储类型（统一使用小端序）
+# 音高使用有符号类型：transkun 用负数音高表示踏板事件
+NOTE_COLUMNS = (
+    ("onset", np.dtype("<f8")),
+    ("offset", np.dtype("<f8")),
+    ("pitch", np.dtype("<i2")),
+    ("velocity", np.dtype("<i2")),
+)
+
+# .notes 二进制文件布局：
+#   [0, 64)        文件头
+#   之后依次为 onset(f8[n]) offset(f8[n]) pitch(i2[n]) velocity(i2[n])
+# 列按对齐要求从大到小排列，所以每一列都可以直接 view 成对应类型
+NOTES_MAGIC = b"TKNOTES\x00"
+NOTES_VERSION = 1
+_HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("flags", "<u4"),
+    ("count", "<u8"),
+    ("reserved", "V40"),
+])
+assert _HEADER_DTYPE.itemsize == 64
+
+
+def notes_to_arrays(notes):
+    """
+    将转录得到的音符对象列表转换为列式numpy数组。
+
+    :param notes: model.transcribe 返回的音符列表（带有 start/end/pitch/velocity 属性）。
+    :return: 列名到numpy数组的字典，按起始时间排序。
+    """
+    count = len(notes)
+    arrays = {
+        "onset": np.fromiter((n.start for n in notes), dtype=np.float64, count=count),
+        "offset": np.fromiter((n.end for n in notes), dtype=np.float64, count=count),
+        "pitch": np.fromiter((n.pitch for n in notes), dtype=np.int16, count=count),
+        "velocity": np.fromiter((n.velocity for n in notes), dtype=np.int16, count=count),
+    }
+
+    # 按起始时间稳定排序，方便下游直接二分查找
+    order = np.argsort(arrays["onset"], kind="stable")
+    return {name: arr[order] for name, arr in arrays.items()}
+
+
+def _column_offsets(count):
+    """计算 .notes 文件中每一列的字节偏移量。"""
+    offsets = {}
+    pos = _HEADER_DTYPE.itemsize
+    for name, dtype in NOTE_COLUMNS:
+        offsets[name] = pos
+        pos += dtype.itemsize * count
+    return offsets, pos
+
+
+def write_notes_npz(arrays, path):
+    """保存为未压缩的NPZ文件。"""
+    with open(path, "wb") as f:
+        np.savez(f, **{name: arrays[name].astype(dtype, copy=False) for name, dtype in NOTE_COLUMNS})
+    return path
+
+
+def write_notes_bin(arrays, path):
+    """保存为固定布局的 .notes 二进制文件。"""
+    count = len(arrays["onset"])
+    header = np.zeros(1, dtype=_HEADER_DTYPE)
+    header["magic"] = NOTES_MAGIC
+    header["version"] = NOTES_VERSION
+    header["count"] = count
+
+    with open(path, "wb") as f:
+        f.write(header.tobytes())
+        for name, dtype in NOTE_COLUMNS:
+            f.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+    return path
+
+
+def write_notes_jsonl(arrays, path):
+    """保存为JSONL文件，每行一个音符。"""
+    with open(path, "w", encoding="utf-8") as f:
+        for onset, offset, pitch, velocity in zip(arrays["onset"].tolist(), arrays["offset"].tolist(),
+                                                  arrays["pitch"].tolist(), arrays["velocity"].tolist()):
+            f.write(json.dumps({"onset": onset, "offset": offset, "pitch": pitch, "velocity": velocity}))
+            f.write("\n")
+    return path
+
+
+_WRITERS = {
+    "npz": (".npz", write_notes_npz),
+    "notes": (".notes", write_notes_bin),
+    "jsonl": (".jsonl", write_notes_jsonl),
+}
+
+
+def save_notes(notes, output_stem, formats):
+    """
+    按指定格式保存音符数据。
+
+    :param notes: model.transcribe 返回的音符列表。
+    :param output_stem: 输出文件路径（不含扩展名）。
+    :param formats: 需要输出的格式，取值见 NOTE_FORMATS。
+    :return: 生成的文件路径列表。
+    """
+    unknown = [fmt for fmt in formats if fmt not in _WRITERS]
+    if unknown:
+        raise ValueError(f"不支持的音符数据格式: {', '.join(unknown)}")
+
+    if not formats:
+        return []
+
+    arrays = notes_to_arrays(notes)
+    output_files = []
+    for fmt in formats:
+        suffix, writer = _WRITERS[fmt]
+        output_files.append(writer(arrays, str(output_stem) + suffix))
+    return output_files
+
+
+def load_notes_bin(path):
+    """
+    以内存映射的方式读取 .notes 文件，不复制数据。
+
+    :param path: .notes 文件路径。
+    :return: 列名到只读numpy数组的字典，数组直接引用映射的文件页。
+    """
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    if mm.shape[0] < _HEADER_DTYPE.itemsize:
+        raise ValueError(f"文件过短，不是有效的音符数据文件: {path}")
+
+    header = mm[:_HEADER_DTYPE.itemsize].view(_HEADER_DTYPE)[0]
+    if bytes(header["magic"]) != NOTES_MAGIC.rstrip(b"\x00"):
+        raise ValueError(f"文件头不匹配，不是有效的音符数据文件: {path}")
+    if header["version"] != NOTES_VERSION:
+        raise ValueError(f"不支持的音符数据文件版本: {header['version']}")
+
+    count = int(header["count"])
+    offsets, total_size = _column_offsets(count)
+    if mm.shape[0] < total_size:
+        raise ValueError(f"文件被截断，期望 {total_size} 字节，实际 {mm.shape[0]} 字节: {path}")
+
+    return {
+        name: mm[offsets[name]:offsets[name] + dtype.itemsize * count].view(dtype)
+        for name, dtype in NOTE_COLUMNS
+    }
+
+
+def load_notes_npz(path):
+    """读取NPZ文件。"""
+    with np.load(path) as data:
+        return {name: data[name] for name, _ in NOTE_COLUMNS}
+
+
+def load_notes_jsonl(path):
+    """读取JSONL文件。"""
+    rows = {name: [] for name, _ in NOTE_COLUMNS}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            note = json.loads(line)
+            for name, _ in NOTE_COLUMNS:
+                rows[name].append(note[name])
+    return {name: np.asarray(rows[name], dtype=dtype) for name, dtype in NOTE_COLUMNS}
+
+
+def load_notes(path):
+    """根据扩展名读取任意一种音符数据文件。"""
+    path = str(path)
+    if path.endswith(".notes"):
+        return load_notes_bin(path)
+    if path.endswith(".npz"):
+        return load_notes_npz(path)
+    if path.endswith(".jsonl"):
+        return load_notes_jsonl(path)
+    raise ValueError(f"无法识别的音符数据文件: {path}")
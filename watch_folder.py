@@ -0,0 +1,421 @@
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+
+from gradio_app import (
+    cuda_available,
+    process_audio,
+    AUDIO_EXTENSIONS,
+    SPEED_PROFILES,
+    DEFAULT_SPEED_PROFILE,
+)
+from note_export import NOTE_FORMATS
+
+# 监视文件夹：录音设备把文件放进共享目录后自动转录。
+#
+#   - Linux 下安装了 inotify_simple 时使用 inotify 监听文件变化，否则定期扫描目录
+#   - 文件大小和修改时间在一段时间内不再变化才认为写入完成
+#   - 按文件内容的哈希去重，处理过的文件记录在清单（transkun_manifest.json）中
+#   - 固定数量的工作线程处理，短时间内涌入大量文件时只会排队，不会无限制地增加任务
+#   - 输出文件和清单默认放在输入文件旁边
+#
+# 用法:
+#   python watch_folder.py /mnt/recordings --workers 2 --speed-profile fast
+
+MANIFEST_NAME = "transkun_manifest.json"
+
+# 计算哈希时每次读取的字节数
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 输出文件名中内容哈希的长度
+OUTPUT_HASH_LENGTH = 8
+
+# 使用 inotify 时，仍然按这个间隔（秒）完整扫描一次目录，
+# 防止网络共享目录等收不到 inotify 事件的情况漏掉文件
+INOTIFY_RESCAN_INTERVAL = 60
+
+
+def file_hash(path):
+    """
+    计算文件内容的 SHA-256。
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _no_progress(*args, **kwargs):
+    pass
+
+
+class Manifest:
+    """
+    记录已处理文件的清单，按内容哈希索引，保存在输出目录中。
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self.entries = {}
+        self.lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f).get("files", {})
+
+    def get(self, digest):
+        with self.lock:
+            return self.entries.get(digest)
+
+    def record(self, digest, entry):
+        """
+        记录一个文件的处理结果并立即保存。
+        """
+        with self.lock:
+            self.entries[digest] = entry
+            # 先写临时文件再替换，避免中途退出时清单损坏
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"files": self.entries}, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+
+
+class FolderWatcher:
+    """
+    监视输入目录，等待文件写入完成后去重并交给工作线程转录。
+    """
+
+    def __init__(self, input_dirs, output_dir=None, workers=1, use_cuda=True, use_quantize=True,
+                 speed_profile=DEFAULT_SPEED_PROFILE, note_formats=(), settle_seconds=5.0, poll_interval=2.0):
+        """
+        :param input_dirs: 要监视的目录列表。
+        :param output_dir: 输出目录，None 表示放在输入文件旁边。
+        :param workers: 同时转录的文件数。
+        :param use_cuda: 是否使用CUDA加速。
+        :param use_quantize: 是否对生成的MIDI文件进行量化处理。
+        :param speed_profile: 推理速度档位，见 SPEED_PROFILES。
+        :param note_formats: 额外导出的音符数据格式。
+        :param settle_seconds: 文件大小和修改时间保持不变多久后才认为写入完成。
+        :param poll_interval: 检查文件状态（以及轮询模式下扫描目录）的间隔（秒）。
+        """
+        self.input_dirs = [os.path.abspath(d) for d in input_dirs]
+        self.output_dir = os.path.abspath(output_dir) if output_dir else None
+        self.workers = max(1, workers)
+        self.use_cuda = use_cuda
+        self.use_quantize = use_quantize
+        self.speed_profile = speed_profile
+        self.note_formats = tuple(note_formats)
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+
+        # 等待写入完成的文件：路径 -> (大小, 修改时间, 最后一次变化的时间)
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        # 已经交给工作线程的文件，在处理完之前不再重复检查
+        self.queued = set()
+        # 已经处理过的文件：路径 -> (大小, 修改时间)，文件没有变化时重新扫描到也直接忽略
+        self.handled = {}
+        # 正在处理的文件内容哈希，避免同一内容的多个副本被同时处理
+        self.in_progress_hashes = set()
+        # 等待相同内容处理结束的文件：内容哈希 -> 路径列表
+        self.deferred = {}
+        self.hash_lock = threading.Lock()
+
+        self.work_queue = queue.Queue()
+        self.stop_event = threading.Event()
+        self.manifests = {}
+        self.manifests_lock = threading.Lock()
+
+    def _output_dir_for(self, path):
+        return self.output_dir or os.path.dirname(path)
+
+    def _manifest_for(self, output_dir):
+        with self.manifests_lock:
+            if output_dir not in self.manifests:
+                self.manifests[output_dir] = Manifest(output_dir)
+            return self.manifests[output_dir]
+
+    def _find_done(self, digest):
+        """
+        在所有清单中查找相同内容已处理完成的记录。
+        """
+        with self.manifests_lock:
+            manifests = list(self.manifests.values())
+        for manifest in manifests:
+            entry = manifest.get(digest)
+            if entry and entry.get("status") == "done":
+                return entry
+        return None
+
+    def _is_candidate(self, path):
+        return Path(path).suffix.lower() in AUDIO_EXTENSIONS and os.path.isfile(path)
+
+    def notify(self, path):
+        """
+        登记一个新增或发生变化的文件，等待其写入完成。
+        """
+        path = os.path.abspath(path)
+        if not self._is_candidate(path):
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with self.pending_lock:
+            if path in self.queued or path in self.pending:
+                return
+            if self.handled.get(path) == (stat.st_size, stat.st_mtime):
+                return
+            self.pending[path] = (None, None, time.time())
+
+    def scan(self):
+        """
+        完整扫描一次所有输入目录。
+        """
+        for directory in self.input_dirs:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            self.notify(entry.path)
+            except OSError as e:
+                print(f"扫描目录失败 {directory}: {e}")
+
+    def check_pending(self):
+        """
+        检查等待中的文件，写入完成的放入处理队列。
+        """
+        now = time.time()
+        ready = []
+        with self.pending_lock:
+            for path, (size, mtime, changed_at) in list(self.pending.items()):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # 文件已被删除或移走
+                    del self.pending[path]
+                    continue
+
+                if (stat.st_size, stat.st_mtime) != (size, mtime):
+                    self.pending[path] = (stat.st_size, stat.st_mtime, now)
+                elif stat.st_size > 0 and now - changed_at >= self.settle_seconds:
+                    del self.pending[path]
+                    self.queued.add(path)
+                    ready.append(path)
+
+        for path in ready:
+            self.work_queue.put(path)
+
+    def process_file(self, path):
+        """
+        去重并转录一个文件，输出移动到输出目录并记录清单。
+
+        :return: 文件是否已处理完毕（被取消时返回 False，下次启动时会重新处理）；
+                 相同内容的文件正在处理时返回 None，等它结束后重新排队。
+        """
+        output_dir = self._output_dir_for(path)
+        manifest = self._manifest_for(output_dir)
+
+        digest = file_hash(path)
+        with self.hash_lock:
+            if self._find_done(digest):
+                print(f"跳过 {path}：相同内容已处理")
+                return True
+            if digest in self.in_progress_hashes:
+                # 相同内容正在处理，它失败或被取消时这个文件仍需要处理，所以先不跳过
+                print(f"{path}：相同内容正在处理，完成后再检查")
+                self.deferred.setdefault(digest, []).append(path)
+                return None
+            self.in_progress_hashes.add(digest)
+
+        try:
+            print(f"开始转录 {path}")
+            start_time = time.time()
+            # 退出时通过 stop_event 取消进行中的转录
+            result = process_audio(path, self.use_cuda, self.use_quantize, _no_progress,
+                                   note_formats=self.note_formats, cancel_event=self.stop_event,
+                                   speed_profile=self.speed_profile, parallel_jobs=self.workers)
+            if result.get("cancelled"):
+                return False
+
+            # 输出文件名加上源文件扩展名和内容哈希前缀，例如 take1_wav_1a2b3c4d.mid，
+            # 避免不同目录下的同名文件或同名不同格式的文件互相覆盖
+            source_stem = Path(path).stem
+            output_stem = f"{source_stem}_{Path(path).suffix.lstrip('.').lower()}_{digest[:OUTPUT_HASH_LENGTH]}"
+            outputs = []
+            for temp_file in result["files"]:
+                name = os.path.basename(temp_file)
+                if name.startswith(source_stem):
+                    name = output_stem + name[len(source_stem):]
+                target = os.path.join(output_dir, name)
+                shutil.move(temp_file, target)
+                outputs.append(target)
+            if result["files"]:
+                shutil.rmtree(os.path.dirname(result["files"][0]), ignore_errors=True)
+
+            manifest.record(digest, {
+                "source": path,
+                "status": "done" if outputs else "failed",
+                "message": result["output"],
+                "outputs": outputs,
+                "processed_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "process_seconds": round(time.time() - start_time, 2),
+            })
+            print(f"{path}: {result['output']}")
+            return True
+        finally:
+            with self.hash_lock:
+                self.in_progress_hashes.discard(digest)
+                waiting = self.deferred.pop(digest, [])
+            # 等待中的相同内容文件重新排队：已完成则跳过，否则由其中一个接着处理
+            for waiting_path in waiting:
+                self.work_queue.put(waiting_path)
+
+    def _worker(self):
+        while not self.stop_event.is_set():
+            try:
+                path = self.work_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            handled = True
+            try:
+                handled = self.process_file(path)
+            except Exception as e:
+                print(f"处理文件失败 {path}: {e}")
+
+            # 返回 None 表示在等待相同内容处理结束，文件仍然算作已排队，稍后会被重新放入队列
+            if handled is not None:
+                with self.pending_lock:
+                    self.queued.discard(path)
+                    if handled:
+                        try:
+                            stat = os.stat(path)
+                            self.handled[path] = (stat.st_size, stat.st_mtime)
+                        except OSError:
+                            pass
+            self.work_queue.task_done()
+
+    def _watch_inotify(self, inotify, watch_flags):
+        """
+        读取 inotify 事件，出错时（如达到监视数量上限、目录被删除）退回轮询。
+        """
+        try:
+            watch_dirs = {inotify.add_watch(directory, watch_flags): directory for directory in self.input_dirs}
+            last_scan = time.time()
+            while not self.stop_event.is_set():
+                for event in inotify.read(timeout=int(self.poll_interval * 1000)):
+                    directory = watch_dirs.get(event.wd)
+                    if directory and event.name:
+                        self.notify(os.path.join(directory, event.name))
+                if time.time() - last_scan >= INOTIFY_RESCAN_INTERVAL:
+                    self.scan()
+                    last_scan = time.time()
+        except Exception as e:
+            print(f"inotify 监视失败，改为轮询模式: {e}")
+            try:
+                inotify.close()
+            except OSError:
+                pass
+            self._watch_polling()
+
+    def _watch_polling(self):
+        while not self.stop_event.is_set():
+            self.scan()
+            self.stop_event.wait(self.poll_interval)
+
+    def _start_watcher(self):
+        """
+        优先使用 inotify，不可用时使用轮询。
+        """
+        try:
+            from inotify_simple import INotify, flags
+            inotify = INotify()
+            watch_flags = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+            target = lambda: self._watch_inotify(inotify, watch_flags)
+            mode = "inotify"
+        except (ImportError, OSError):
+            target = self._watch_polling
+            mode = "轮询"
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        return mode
+
+    def run(self):
+        """
+        开始监视，直到按下 Ctrl+C。
+        """
+        for directory in self.input_dirs:
+            if not os.path.isdir(directory):
+                raise FileNotFoundError(f"找不到输入目录: {directory}")
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+
+        # 预先加载所有清单，使去重覆盖所有目录
+        for directory in [self.output_dir] if self.output_dir else self.input_dirs:
+            self._manifest_for(directory)
+
+        workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.workers)]
+        for worker in workers:
+            worker.start()
+
+        # 启动时先处理目录中已有的文件
+        self.scan()
+        mode = self._start_watcher()
+        print(f"正在监视 {', '.join(self.input_dirs)}（{mode}模式，{self.workers} 个工作线程），按 Ctrl+C 退出")
+
+        try:
+            while not self.stop_event.is_set():
+                self.check_pending()
+                self.stop_event.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            print("正在退出，取消进行中的转录...")
+        finally:
+            self.stop_event.set()
+            for worker in workers:
+                worker.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="监视文件夹，自动转录新加入的音频文件")
+    parser.add_argument("input_dirs", nargs="+", help="要监视的目录")
+    parser.add_argument("--output-dir", default=None, help="输出目录，默认放在输入文件旁边")
+    parser.add_argument("--workers", type=int, default=1, help="同时转录的文件数")
+    parser.add_argument("--no-cuda", action="store_true", help="不使用CUDA加速")
+    parser.add_argument("--no-quantize", action="store_true", help="不进行MIDI规整化")
+    parser.add_argument("--speed-profile", default=DEFAULT_SPEED_PROFILE, choices=list(SPEED_PROFILES.keys()),
+                        help="推理速度档位")
+    parser.add_argument("--note-formats", nargs="*", default=[], choices=list(NOTE_FORMATS),
+                        help="额外导出的音符数据格式")
+    parser.add_argument("--settle-seconds", type=float, default=5.0,
+                        help="文件保持不变多少秒后才认为写入完成")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="检查文件状态的间隔（秒）")
+    args = parser.parse_args()
+
+    watcher = FolderWatcher(
+        args.input_dirs,
+        output_dir=args.output_dir,
+        workers=args.workers,
+        use_cuda=cuda_available and not args.no_cuda,
+        use_quantize=not args.no_quantize,
+        speed_profile=args.speed_profile,
+        note_formats=args.note_formats,
+        settle_seconds=args.settle_seconds,
+        poll_interval=args.poll_interval,
+    )
+    try:
+        watcher.run()
+    except FileNotFoundError as e:
+        print(e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()